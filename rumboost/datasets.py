@@ -876,13 +876,74 @@ def stratified_group_k_fold(X, y, groups, k, seed=None):
         yield train_indices, test_indices
 
 
+def _as_numpy(data, columns=None, num_rows=None):
+    """
+    Convert columns of a DataFrame or numpy array to a C-contiguous float
+    numpy array, as expected by lightgbm datasets. The columns are cast one by
+    one into a preallocated array, without building the intermediate DataFrame
+    of the selected columns nor the copies of pandas' to_numpy.
+
+    The array has the dtype that lightgbm would bin from the values of the
+    columns: float64 if they are float64 (or mixed with other types, as in
+    DataFrame.values), float32 otherwise. Float64 features are therefore
+    not rounded.
+
+    Parameters
+    ----------
+    data : pandas DataFrame or numpy array
+        The data to convert.
+    columns : list, optional
+        The columns to convert, as names for a DataFrame and indices for a numpy
+        array. If None, all columns are converted.
+    num_rows : int, optional
+        If given, the columns are stacked in Fortran order into num_rows rows,
+        as for shared ensembles.
+
+    Returns
+    -------
+    array : numpy array
+        The converted data, of shape (num_rows, -1) if num_rows is given, or
+        (n_obs, len(columns)) otherwise.
+    """
+    if isinstance(data, np.ndarray):
+        dtypes = [data.dtype]
+    else:
+        if columns is None:
+            columns = data.columns
+        dtypes = [data[column].dtype for column in columns]
+    try:
+        dtype = np.result_type(*dtypes)
+    except TypeError:  # pandas extension dtypes
+        dtype = None
+    if dtype != np.float64:
+        dtype = np.float32  # lightgbm casts non float64 data to float32
+
+    if columns is None:
+        return np.ascontiguousarray(data, dtype=dtype)
+
+    num_obs = data.shape[0]
+    stacked = num_rows is not None and num_rows != num_obs
+    array = np.empty(
+        (num_obs, len(columns)), dtype=dtype, order="F" if stacked else "C"
+    )
+    for i, column in enumerate(columns):
+        if isinstance(data, np.ndarray):
+            array[:, i] = data[:, column]
+        else:
+            array[:, i] = data[column].to_numpy()
+
+    if stacked:
+        return np.ascontiguousarray(array.reshape((num_rows, -1), order="F"))
+    return array
+
+
 def prepare_dataset(
     rum_structure,
     df_train,
     num_classes,
     df_test=None,
     target="choice",
-    free_raw_data=False,
+    free_raw_data=True,
     save_dataset=None,
     load_dataset=None,
 ):
@@ -904,7 +965,7 @@ def prepare_dataset(
     target : str, optional
         The target variable.
     free_raw_data : bool, optional
-        If the raw data should be freed.
+        If the raw data should be freed once the datasets are constructed.
     save_dataset : str, optional
         The path to save the datasets.
     load_dataset : str, optional
@@ -988,13 +1049,21 @@ def prepare_dataset(
 
     train_set_J = []
     reduced_valid_sets_J = []
+    binned_sets = {}  # first dataset built for given features and boosting parameters
     for j, struct in enumerate(rum_structure):
         print("-" * 30 + "\n" + f"[{j+1}/{num_datasets}] \t Loading dataset {j+1}...")
         if struct:
             if "variables" in struct:
-                train_set_j_data = df_train[
-                    struct["variables"]
-                ]  # only relevant features for the jth booster
+                # boosters with the same features, number of utilities and boosting
+                # parameters reuse the bin mappers of the first dataset built with them
+                binned_key = (
+                    tuple(struct["variables"]),
+                    struct["shared"],
+                    len(struct["utility"]),
+                )
+                binned_params, reference_j = binned_sets.get(binned_key, (None, None))
+                if binned_params != struct["boosting_params"]:
+                    reference_j = None
 
                 if struct["shared"] == True:
                     new_label = labels_j[
@@ -1005,10 +1074,15 @@ def prepare_dataset(
                     new_label = labels_j[:, 0].reshape(-1, order="F")
                     feature_names = struct["variables"]
                 train_set_j = Dataset(
-                    train_set_j_data.values.reshape((len(new_label), -1), order="A"),
+                    _as_numpy(
+                        df_train, struct["variables"], len(new_label)
+                    ),  # only relevant features for the jth booster
                     label=new_label,
                     free_raw_data=free_raw_data,
+                    reference=reference_j,
                 )  # create and build dataset
+                if reference_j is None:
+                    binned_sets[binned_key] = (struct["boosting_params"], train_set_j)
                 categorical_feature = struct["boosting_params"].get(
                     "categorical_feature", "auto"
                 )
@@ -1022,10 +1096,6 @@ def prepare_dataset(
                     reduced_valid_sets_j = []
                     for i, valid_set in enumerate(df_test):
                         # create and build validation sets
-                        valid_set_j_data = valid_set[
-                            struct["variables"]
-                        ]  # only relevant features for the jth booster
-
                         if struct["shared"] == True:
                             label_valid = val_labels_j[i][
                                 :, struct["utility"][: len(struct["variables"])]
@@ -1033,12 +1103,11 @@ def prepare_dataset(
                         else:
                             label_valid = val_labels_j[i][:, 0].reshape(-1, order="F")
                         valid_set_j = Dataset(
-                            valid_set_j_data.values.reshape(
-                                (len(label_valid), -1),
-                                order="A",
-                            ),
+                            _as_numpy(
+                                valid_set, struct["variables"], len(label_valid)
+                            ),  # only relevant features for the jth booster
                             label=label_valid,
-                            free_raw_data=False,
+                            free_raw_data=free_raw_data,
                             reference=train_set_j,
                         )  # create and build dataset
                         valid_set_j._update_params(struct["boosting_params"])
@@ -1056,8 +1125,6 @@ def prepare_dataset(
                 if df_test is not None:
                     reduced_valid_sets_J.append(reduced_valid_sets_j)
                 del (
-                    train_set_j_data,
-                    valid_set_j_data,
                     train_set_j,
                     valid_set_j,
                 )
@@ -1068,7 +1135,9 @@ def prepare_dataset(
                 # if no alternative specific datasets
                 new_label = np.where(labels == j, 1, 0)
                 train_set_j = Dataset(
-                    df_train.values, label=new_label, free_raw_data=False
+                    _as_numpy(df_train),
+                    label=new_label,
+                    free_raw_data=free_raw_data,
                 )
                 if df_test is not None:
                     reduced_valid_sets_j = df_test[:]
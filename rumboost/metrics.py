@@ -40,7 +40,8 @@ def cross_entropy(preds, labels):
     """
     num_data = len(labels)
     data_idx = np.arange(num_data)
-    return -np.mean(np.log(preds[data_idx, labels]))
+    # preds may be float32, the loss is reported in float64
+    return -np.mean(np.log(preds[data_idx, labels], dtype=np.float64))
 
 def binary_cross_entropy(preds, labels):
     """
@@ -59,7 +60,7 @@ def binary_cross_entropy(preds, labels):
     Cross entropy : float
         The negative cross-entropy, as float.
     """
-    preds = preds.reshape(-1)
+    preds = preds.reshape(-1).astype(np.float64, copy=False)
     return -np.mean(labels * np.log(preds) + (1 - labels) * np.log(1 - preds))
 
 def mse(preds, target):
@@ -79,7 +80,7 @@ def mse(preds, target):
     Mean squared error : float
         The mean squared error, as float.
     """
-    return np.mean((preds.reshape(-1) - target) ** 2)
+    return np.mean((preds.reshape(-1).astype(np.float64, copy=False) - target) ** 2)
 
 
 def weighted_binary_cross_entropy(preds, labels):
@@ -103,6 +104,7 @@ def weighted_binary_cross_entropy(preds, labels):
     """
     classes = np.arange(np.unique(labels).shape[0] - 1)
     binary_labels = labels[:, None] > classes[None, :]
+    preds = preds.astype(np.float64, copy=False)
     return -np.mean(
         np.sum(
             binary_labels * np.log(preds) + (1 - binary_labels) * np.log(1 - preds),
@@ -51,22 +51,31 @@ def nest_probs(raw_preds, mu, nests, nest_alt):
     nests_array = np.array(list(nests.keys()))
     n_mu = nests_array.shape[0]
 
-    mu_raw_preds_3d = np.exp(mu_obs * raw_preds)[:, :, None]
-    # sum_in_nest = np.sum(mu_raw_preds_3d * mask_3d, axis=1)
-    mask_3d = (nest_alt[:, None] == nests_array[None, :])[None, :, :]
-    sum_in_nest = np.sum(mu_raw_preds_3d * mask_3d, axis=1)
-
-    pred_i_m = np.exp(mu_obs * raw_preds) / np.sum(
-        sum_in_nest[:, None, :] * mask_3d, axis=2
+    # incidence matrix of alternatives (rows) in nests (columns), so that
+    # sums within nests and broadcasts back to alternatives are matrix products
+    nest_incidence = (nest_alt[:, None] == nests_array[None, :]).astype(
+        raw_preds.dtype
     )
 
-    V_tilde_m = 1 / mu * np.log(sum_in_nest)
+    # log-sum-exp trick: shift the scaled utilities by their maximum in each
+    # nest before exponentiating, to avoid overflow and empty nest sums
+    mu_raw_preds = mu_obs * raw_preds
+    max_mu_raw_preds = np.where(
+        nest_incidence.T[None, :, :] > 0, mu_raw_preds[:, None, :], -np.inf
+    ).max(axis=2)
+    exp_mu_raw_preds = np.exp(mu_raw_preds - max_mu_raw_preds @ nest_incidence.T)
+    sum_in_nest = exp_mu_raw_preds @ nest_incidence
+
+    pred_i_m = exp_mu_raw_preds / (sum_in_nest @ nest_incidence.T)
+
+    # inclusive value of each nest, shifted back
+    V_tilde_m = 1 / mu * (np.log(sum_in_nest) + max_mu_raw_preds)
 
     # Pred of choosing nest m
     pred_m = softmax(V_tilde_m, axis=1)
 
     # Final predictions for choosing i
-    preds = pred_i_m * np.sum(pred_m[:, None, :] * mask_3d, axis=2)
+    preds = pred_i_m * (pred_m @ nest_incidence.T)
 
     return preds, pred_i_m, pred_m
 
@@ -91,27 +100,39 @@ def cross_nested_probs(raw_preds, mu, alphas):
     preds : numpy.ndarray
         The cross nested predictions
     pred_i_m : numpy.ndarray
-        The prediction of choosing alt i knowing nest m
+        The prediction of choosing alt i knowing nest m, of shape (n_nests, n_obs, n_alt),
+        so that the predictions of each nest are a contiguous block.
     pred_m : numpy.ndarray
         The prediction of choosing nest m
     """
-    # scaling and exponential of raw_preds, following by degree of memberships
-    raw_preds_mu_alpha_3d = (alphas**mu)[None, :, :] * np.exp(
-        mu[None, None, :] * raw_preds[:, :, None]
+    # scaling of raw_preds, with the degrees of membership in the exponent as
+    # alpha^mu * exp(mu * V) = exp(mu * (V + log(alpha))), so that non-members are
+    # -inf and the maximum in each nest is taken over its members only
+    with np.errstate(divide="ignore"):
+        log_alphas = np.log(alphas.T)
+    mu_raw_preds_3d = mu[:, None, None] * (
+        raw_preds[None, :, :] + log_alphas[:, None, :]
     )
+    max_mu_raw_preds = np.max(mu_raw_preds_3d, axis=2, keepdims=True)
+
+    # exponential of scaled raw_preds, shifted by the maximum in each nest
+    # (log-sum-exp trick)
+    raw_preds_mu_alpha_3d = np.exp(mu_raw_preds_3d - max_mu_raw_preds)
     # storing sum of utilities in nests
-    sum_in_nest = np.sum(raw_preds_mu_alpha_3d, axis=1) ** (1 / mu)[None, :]
+    sum_in_nest = np.sum(raw_preds_mu_alpha_3d, axis=2, keepdims=True)
 
     # pred of choosing i knowing m.
-    pred_i_m = raw_preds_mu_alpha_3d / np.sum(
-        raw_preds_mu_alpha_3d, axis=1, keepdims=True
-    )
+    pred_i_m = raw_preds_mu_alpha_3d / sum_in_nest
 
-    # pred of choosing m
-    pred_m = sum_in_nest / np.sum(sum_in_nest, axis=1, keepdims=True)
+    # pred of choosing m, from the log of the sum of utilities in nests
+    V_tilde_m = (
+        (np.log(sum_in_nest[:, :, 0]) + max_mu_raw_preds[:, :, 0]) / mu[:, None]
+    ).T
+    pred_m = softmax(V_tilde_m, axis=1)
 
-    # final predictions for choosing i
-    preds = np.sum(pred_i_m * pred_m[:, None, :], axis=2)
+    # final predictions for choosing i, summed over nests without
+    # allocating the (n_nests, n_obs, n_alt) product
+    preds = np.einsum("mnk,nm->nk", pred_i_m, pred_m)
 
     return preds, pred_i_m, pred_m
 
@@ -123,6 +144,7 @@ def optimise_mu_or_alpha(
     optimise_mu,
     optimise_alpha,
     alpha_shape,
+    raw_preds=None,
 ):
     """
     Optimize mu or alpha values for a given dataset.
@@ -141,6 +163,9 @@ def optimise_mu_or_alpha(
         Whether to optimize alpha values.
     alpha_shape : tuple
         The shape of the alpha values.
+    raw_preds : numpy.ndarray or torch.Tensor, optional (default=None)
+        The raw predictions of the subsampled observations, of shape (n_obs, n_alt).
+        If None, they are gathered from rumb at each call.
 
     Returns
     -------
@@ -177,17 +202,23 @@ def optimise_mu_or_alpha(
             )
             alphas = alphas / alphas.sum(dim=1, keepdim=True)
             mu = rumb.mu.type(torch.float64) if rumb.mu is not None else None
+        if raw_preds is None:
+            raw_preds = (
+                rumb.raw_preds.view(-1, rumb.num_obs[0])
+                .T[rumb.subsample_idx, :]
+                .type(torch.float64)
+            )
         if rumb.nests:
             if rumb.torch_compile:
                 new_preds, _, _ = _nest_probs_torch_compiled(
-                    rumb.raw_preds.view(-1, rumb.num_obs[0]).T[rumb.subsample_idx, :].type(torch.float64),
+                    raw_preds,
                     mu,
                     rumb.nests,
                     rumb.device,
                 )
             else:
                 new_preds, _, _ = _nest_probs_torch(
-                    rumb.raw_preds.view(-1, rumb.num_obs[0]).T[rumb.subsample_idx, :].type(torch.float64),
+                    raw_preds,
                     mu,
                     rumb.nests,
                     rumb.device,
@@ -195,14 +226,14 @@ def optimise_mu_or_alpha(
         else:
             if rumb.torch_compile:
                 new_preds, _, _ = _cross_nested_probs_torch_compiled(
-                    rumb.raw_preds.view(-1, rumb.num_obs[0]).T[rumb.subsample_idx, :].type(torch.float64),
+                    raw_preds,
                     mu,
                     alphas,
                     rumb.device,
                 )
             else:
                 new_preds, _, _ = _cross_nested_probs_torch(
-                    rumb.raw_preds.view(-1, rumb.num_obs[0]).T[rumb.subsample_idx, :].type(torch.float64),
+                    raw_preds,
                     mu,
                     alphas,
                     rumb.device,
@@ -224,20 +255,20 @@ def optimise_mu_or_alpha(
             alphas = alphas / alphas.sum(axis=1, keepdims=True)
             mu = rumb.mu
 
+        if raw_preds is None:
+            raw_preds = rumb.raw_preds.reshape(rumb.num_obs[0], -1, order="F")[
+                rumb.subsample_idx, :
+            ]
         if rumb.nests:
             new_preds, _, _ = nest_probs(
-                rumb.raw_preds.reshape(rumb.num_obs[0], -1, order="F")[
-                    rumb.subsample_idx, :
-                ],
+                raw_preds,
                 mu,
                 rumb.nests,
                 rumb.nest_alt,
             )
         else:
             new_preds, _, _ = cross_nested_probs(
-                rumb.raw_preds.reshape(rumb.num_obs[0], -1, order="F")[
-                    rumb.subsample_idx, :
-                ],
+                raw_preds,
                 mu,
                 alphas,
             )
@@ -0,0 +1,229 @@
+import numpy as np
+
+try:
+    from numba import njit, prange
+
+    numba_installed = True
+    jit_decorator = njit(parallel=True, fastmath=True, cache=True)
+except ImportError:
+    numba_installed = False
+    jit_decorator = lambda func: func
+    prange = range
+
+
+@jit_decorator
+def _f_obj_numba(labels, preds, utility, factor, eps, grad, hess):
+    """
+    Gradient and hessian of the cross-entropy loss with softmax probabilities,
+    for the alternatives in utility. Compiled with numba, looping over observations
+    so that the one-hot labels and the predictions of utility are not gathered.
+
+    Parameters
+    ----------
+    labels : numpy array
+        The labels of the observations, as int.
+    preds : numpy array
+        The softmax predictions, of shape (n_obs, n_alt).
+    utility : numpy array
+        The alternatives for which the gradient and hessian are computed.
+    factor : float
+        The factor to correct redundancy.
+    eps : float
+        The minimum value of the hessian.
+    grad : numpy array
+        The array of shape (n_obs, len(utility)) where the gradient is written.
+    hess : numpy array
+        The array of shape (n_obs, len(utility)) where the hessian is written.
+
+    Returns
+    -------
+    grad : numpy array
+        The gradient, of shape (n_obs, len(utility)).
+    hess : numpy array
+        The hessian, of shape (n_obs, len(utility)).
+    """
+    n_obs = preds.shape[0]
+    n_util = utility.shape[0]
+
+    for n in prange(n_obs):
+        for u in range(n_util):
+            j = utility[u]
+            pred = preds[n, j]
+            grad[n, u] = pred - (labels[n] == j)
+            # truncate low values to avoid numerical errors
+            hess[n, u] = max(factor * pred * (1 - pred), eps)
+
+    return grad, hess
+
+
+@jit_decorator
+def _f_obj_nested_numba(
+    labels, preds_i_m, preds_m, mu, nest_alt, utility, factor, grad, hess
+):
+    """
+    Gradient and hessian of the cross-entropy loss with nested probabilities,
+    for the alternatives in utility. Compiled with numba, looping over observations.
+
+    Parameters
+    ----------
+    labels : numpy array
+        The labels of the observations, as int.
+    preds_i_m : numpy array
+        The prediction of choosing alt i knowing its nest, of shape (n_obs, n_alt).
+    preds_m : numpy array
+        The prediction of choosing nest m, of shape (n_obs, n_nests).
+    mu : numpy array
+        The mu value of each nest.
+    nest_alt : numpy array
+        The nest of each alternative.
+    utility : numpy array
+        The alternatives for which the gradient and hessian are computed.
+    factor : float
+        The factor to correct redundancy.
+    grad : numpy array
+        The array of shape (n_obs, len(utility)) where the gradient is written.
+    hess : numpy array
+        The array of shape (n_obs, len(utility)) where the hessian is written.
+
+    Returns
+    -------
+    grad : numpy array
+        The gradient, of shape (n_obs, len(utility)).
+    hess : numpy array
+        The hessian, of shape (n_obs, len(utility)).
+    """
+    n_obs = preds_i_m.shape[0]
+    n_util = utility.shape[0]
+
+    for n in prange(n_obs):
+        label = labels[n]
+        label_nest = nest_alt[label]
+        for u in range(n_util):
+            j = utility[u]
+            nest_j = nest_alt[j]
+            mu_j = mu[nest_j]
+            pred_i_m = preds_i_m[n, j]
+            pred_m = preds_m[n, nest_j]
+            if label == j:
+                grad[n, u] = -mu_j * (1 - pred_i_m) - pred_i_m * (1 - pred_m)
+            elif label_nest == nest_j:
+                grad[n, u] = mu_j * pred_i_m - pred_i_m * (1 - pred_m)
+            else:
+                grad[n, u] = pred_i_m * pred_m
+            if label_nest == nest_j:
+                hess[n, u] = factor * (
+                    -mu_j * pred_i_m * (1 - pred_i_m) * (1 - mu_j - pred_m)
+                    + pred_i_m**2 * pred_m * (1 - pred_m)
+                )
+            else:
+                hess[n, u] = factor * (
+                    -pred_i_m
+                    * pred_m
+                    * (-mu_j * (1 - pred_i_m) - pred_i_m * (1 - pred_m))
+                )
+
+    return grad, hess
+
+
+@jit_decorator
+def _f_obj_cross_nested_numba(
+    labels, preds_i_m, preds_m, preds, mu, utility, factor, grad, hess
+):
+    """
+    Gradient and hessian of the cross-entropy loss with cross-nested probabilities,
+    for the alternatives in utility. Compiled with numba, looping over observations
+    so that no (n_obs, n_alt, n_nests) temporary array is created.
+
+    Parameters
+    ----------
+    labels : numpy array
+        The labels of the observations, as int.
+    preds_i_m : numpy array
+        The prediction of choosing alt i knowing nest m, of shape (n_nests, n_obs, n_alt).
+    preds_m : numpy array
+        The prediction of choosing nest m, of shape (n_obs, n_nests).
+    preds : numpy array
+        The prediction of choosing alt i, of shape (n_obs, n_alt).
+    mu : numpy array
+        The mu value of each nest.
+    utility : numpy array
+        The alternatives for which the gradient and hessian are computed.
+    factor : float
+        The factor to correct redundancy.
+    grad : numpy array
+        The array of shape (n_obs, len(utility)) where the gradient is written.
+    hess : numpy array
+        The array of shape (n_obs, len(utility)) where the hessian is written.
+
+    Returns
+    -------
+    grad : numpy array
+        The gradient, of shape (n_obs, len(utility)).
+    hess : numpy array
+        The hessian, of shape (n_obs, len(utility)).
+    """
+    n_obs = preds_i_m.shape[1]
+    n_nests = preds_i_m.shape[0]
+    n_util = utility.shape[0]
+
+    for n in prange(n_obs):
+        i = labels[n]
+        pred_i = preds[n, i]
+        for u in range(n_util):
+            j = utility[u]
+            pred_j = preds[n, j]
+
+            # first derivatives, and second derivatives without their
+            # first derivative term, summed over nests
+            sum_pred_i_m_pred_m = 0.0
+            d_pred_i_Vi = 0.0
+            d_pred_i_Vj = 0.0
+            d_pred_j_Vj = 0.0
+            d2_pred_i_Vi = 0.0
+            d2_pred_i_Vj = 0.0
+            for m in range(n_nests):
+                mu_m = mu[m]
+                pred_m = preds_m[n, m]
+                pred_i_m = preds_i_m[m, n, i]
+                pred_j_m = preds_i_m[m, n, j]
+                pred_i_m_pred_m = pred_i_m * pred_m
+                pred_j_m_1_mu_pred_j = pred_j_m * (1 - mu_m) - pred_j
+
+                sum_pred_i_m_pred_m += pred_i_m_pred_m
+                d_pred_i_Vi += pred_i_m_pred_m * (
+                    pred_i_m * (1 - mu_m) + mu_m - pred_i
+                )
+                d_pred_i_Vj += pred_i_m_pred_m * pred_j_m_1_mu_pred_j
+                d_pred_j_Vj += pred_j_m * pred_m * (pred_j_m_1_mu_pred_j + mu_m)
+                d2_pred_i_Vi += pred_i_m_pred_m * (
+                    mu_m**2 * (2 * pred_i_m**2 - 3 * pred_i_m + 1)
+                    + mu_m
+                    * (
+                        -3 * pred_i_m**2
+                        + 3 * pred_i_m
+                        + 2 * (pred_i_m * pred_i - pred_i)
+                    )
+                    + pred_i_m**2
+                    - 2 * pred_i_m * pred_i
+                    + pred_i**2
+                )
+                d2_pred_i_Vj += pred_i_m_pred_m * (
+                    -(mu_m**2) * pred_j_m
+                    + mu_m * (-(pred_j_m**2) + pred_j_m)
+                    + (pred_j_m - pred_j) ** 2
+                )
+            d2_pred_i_Vi -= sum_pred_i_m_pred_m * d_pred_i_Vi
+            d2_pred_i_Vj -= sum_pred_i_m_pred_m * d_pred_j_Vj
+
+            if i == j:
+                grad[n, u] = -d_pred_i_Vi / pred_i
+                hess[n, u] = (
+                    -factor * (d2_pred_i_Vi * pred_i - d_pred_i_Vi**2) / pred_i**2
+                )
+            else:
+                grad[n, u] = -d_pred_i_Vj / pred_i
+                hess[n, u] = (
+                    -factor * (d2_pred_i_Vj * pred_i - d_pred_i_Vj**2) / pred_i**2
+                )
+
+    return grad, hess
@@ -3,10 +3,12 @@
 import collections
 import copy
 import json
+import os
 import numpy as np
 
 from scipy.special import softmax, expit
 from scipy.optimize import minimize
+from concurrent.futures import ThreadPoolExecutor
 from operator import attrgetter
 from pathlib import Path
 from typing import Any, Callable, Dict, List, Optional, Tuple, Union
@@ -19,6 +21,7 @@ from lightgbm.basic import (
     _ConfigAliases,
     _InnerPredictor,
     _choose_param_value,
+    _get_sample_count,
     _log_warning,
 )
 from lightgbm.compat import SKLEARN_INSTALLED, _LGBMGroupKFold, _LGBMStratifiedKFold
@@ -38,7 +41,14 @@ from rumboost.ordinal import (
     optimise_thresholds_proportional_odds,
 )
 
-from rumboost.utils import optimise_asc, _check_rum_structure
+from rumboost.utils import optimise_asc, _check_rum_structure, _get_raw_data_and_label
+from rumboost.datasets import _as_numpy
+from rumboost.numba_functions import (
+    numba_installed,
+    _f_obj_numba,
+    _f_obj_nested_numba,
+    _f_obj_cross_nested_numba,
+)
 
 try:
     import torch
@@ -67,6 +77,7 @@ try:
         binary_cross_entropy_torch_compiled,
         mse_torch,
         mse_torch_compiled,
+        torch_compile_supported,
     )
 
     torch_installed = True
@@ -132,8 +143,8 @@ class RUMBoost:
                 List of parameters for each booster.
             - labels : numpy array
                 Labels of the dataset.
-            - labels_j : list of numpy array
-                Labels for each booster.
+            - labels_j : numpy array
+                One-hot encoded labels, of shape (num_obs, num_classes).
             - valid_labels : list of numpy array
                 Validation labels.
             - boost_from_parameter_space : list[bool]
@@ -159,6 +170,11 @@ class RUMBoost:
             - thresholds : list of float
                 Thresholds for ordinal model.
 
+            Training attributes:
+            - dtype : numpy dtype
+                The dtype of the probabilities used to compute the gradients
+                and hessians during training. Default to float32.
+
             Torch tensors attributes:
             - device : str
                 Device to use for computations.
@@ -189,6 +205,9 @@ class RUMBoost:
             self.mu = np.array(self.mu)
         if self.thresholds is not None:  # numpy.ndarray so need to specify not None
             self.thresholds = np.array(self.thresholds)
+        if isinstance(self.__dict__.get("labels_j"), list) and self.labels_j:
+            self.labels_j = np.array(self.labels_j, dtype=np.int8)
+        self.dtype = np.dtype(self.__dict__.get("dtype", np.float32))
 
         if isinstance(self.split_and_leaf_values, dict):
             self.split_and_leaf_values = {
@@ -215,6 +234,36 @@ class RUMBoost:
 
         return wrapper
 
+    def _grad_hess_buffers(self, j: int, n_obs: int):
+        """
+        Gradient and hessian buffers of the jth booster, allocated once and
+        refilled in place by the compiled objective functions at each iteration.
+        They are float32 and Fortran-ordered, so that they are flattened
+        without copy and passed as is to LightGBM.
+
+        Parameters
+        ----------
+        j : int
+            The index of the booster.
+        n_obs : int
+            The number of observations used in the iteration.
+
+        Returns
+        -------
+        grad : numpy array
+            The gradient buffer, of shape (n_obs, len(utility)).
+        hess : numpy array
+            The hessian buffer, of shape (n_obs, len(utility)).
+        """
+        buffers = self.__dict__.setdefault("_grad_hess_buf", {})
+        shape = (n_obs, len(self.rum_structure[j]["utility"]))
+        if j not in buffers or buffers[j][0].shape != shape:
+            buffers[j] = (
+                np.empty(shape, dtype=np.float32, order="F"),
+                np.empty(shape, dtype=np.float32, order="F"),
+            )
+        return buffers[j]
+
     def f_obj_full_hessian(self, _, __):
         """
         Objective function of the boosters, for the full hessian.
@@ -307,18 +356,28 @@ class RUMBoost:
 
             return grad.reshape(-1, order="F"), hess.reshape(-1, order="F")
 
-        preds = self._preds[:, self.rum_structure[j]["utility"]]
         factor = self.num_classes / (
             self.num_classes - 1
         )  # factor to correct redundancy (see Friedmann, Greedy Function Approximation)
         eps = 1e-6
-        labels = self.labels_j[:, self.rum_structure[j]["utility"]][
-            self.subsample_idx, :
-        ]
-        grad = preds - labels
-        hess = np.maximum(
-            factor * preds * (1 - preds), eps
-        )  # truncate low values to avoid numerical errors
+        if numba_installed:
+            grad, hess = _f_obj_numba(
+                self.labels[self.subsample_idx],
+                self._preds,
+                np.array(self.rum_structure[j]["utility"]),
+                factor,
+                eps,
+                *self._grad_hess_buffers(j, self._preds.shape[0]),
+            )
+        else:
+            preds = self._preds[:, self.rum_structure[j]["utility"]]
+            labels = self.labels_j[:, self.rum_structure[j]["utility"]][
+                self.subsample_idx, :
+            ]
+            grad = preds - labels
+            hess = np.maximum(
+                factor * preds * (1 - preds), eps
+            )  # truncate low values to avoid numerical errors
 
         if self.subsample_idx.size < self.num_obs[0]:
             grad_rescaled = np.zeros(
@@ -577,47 +636,59 @@ class RUMBoost:
 
         shared_ensemble = np.array(self.rum_structure[j]["utility"])
 
-        pred_i_m = self.preds_i_m[
-            :, shared_ensemble
-        ]  # pred of alternative j knowing nest m
-        pred_m = self.preds_m[
-            :, self.nest_alt[shared_ensemble]
-        ]  # prediction of choosing nest m
-
-        grad = np.where(
-            label[:, None] == shared_ensemble[None, :],
-            -self.mu[self.nest_alt[shared_ensemble]] * (1 - pred_i_m)
-            - pred_i_m * (1 - pred_m),
-            np.where(
-                label_nest[:, None] == self.nest_alt[shared_ensemble][None, :],
-                self.mu[self.nest_alt[shared_ensemble]] * pred_i_m
+        if numba_installed:
+            grad, hess = _f_obj_nested_numba(
+                label,
+                self.preds_i_m,
+                self.preds_m,
+                self.mu,
+                self.nest_alt,
+                shared_ensemble,
+                factor,
+                *self._grad_hess_buffers(j, label.shape[0]),
+            )
+        else:
+            pred_i_m = self.preds_i_m[
+                :, shared_ensemble
+            ]  # pred of alternative j knowing nest m
+            pred_m = self.preds_m[
+                :, self.nest_alt[shared_ensemble]
+            ]  # prediction of choosing nest m
+
+            grad = np.where(
+                label[:, None] == shared_ensemble[None, :],
+                -self.mu[self.nest_alt[shared_ensemble]] * (1 - pred_i_m)
                 - pred_i_m * (1 - pred_m),
-                pred_i_m * pred_m,
-            ),
-        )
-        hess = np.where(
-            label[:, None] == shared_ensemble[None, :],
-            -self.mu[self.nest_alt[shared_ensemble]]
-            * pred_i_m
-            * (1 - pred_i_m)
-            * (1 - self.mu[self.nest_alt[shared_ensemble]] - pred_m)
-            + pred_i_m**2 * pred_m * (1 - pred_m),
-            np.where(
-                label_nest[:, None] == self.nest_alt[shared_ensemble][None, :],
+                np.where(
+                    label_nest[:, None] == self.nest_alt[shared_ensemble][None, :],
+                    self.mu[self.nest_alt[shared_ensemble]] * pred_i_m
+                    - pred_i_m * (1 - pred_m),
+                    pred_i_m * pred_m,
+                ),
+            )
+            hess = np.where(
+                label[:, None] == shared_ensemble[None, :],
                 -self.mu[self.nest_alt[shared_ensemble]]
                 * pred_i_m
                 * (1 - pred_i_m)
                 * (1 - self.mu[self.nest_alt[shared_ensemble]] - pred_m)
                 + pred_i_m**2 * pred_m * (1 - pred_m),
-                -pred_i_m
-                * pred_m
-                * (
-                    -self.mu[self.nest_alt[shared_ensemble]] * (1 - pred_i_m)
-                    - pred_i_m * (1 - pred_m)
+                np.where(
+                    label_nest[:, None] == self.nest_alt[shared_ensemble][None, :],
+                    -self.mu[self.nest_alt[shared_ensemble]]
+                    * pred_i_m
+                    * (1 - pred_i_m)
+                    * (1 - self.mu[self.nest_alt[shared_ensemble]] - pred_m)
+                    + pred_i_m**2 * pred_m * (1 - pred_m),
+                    -pred_i_m
+                    * pred_m
+                    * (
+                        -self.mu[self.nest_alt[shared_ensemble]] * (1 - pred_i_m)
+                        - pred_i_m * (1 - pred_m)
+                    ),
                 ),
-            ),
-        )
-        hess *= factor
+            )
+            hess *= factor
 
         if self.subsample_idx.size < self.num_obs[0]:
             grad_rescaled = np.zeros(
@@ -736,85 +807,93 @@ class RUMBoost:
 
         j = self._current_j
         label = self.labels[self.subsample_idx]
-        data_idx = np.arange(self.preds_i_m.shape[0])
+        data_idx = np.arange(label.shape[0])
         factor = self.num_classes / (self.num_classes - 1)
 
-        pred_j_m = self.preds_i_m[
-            :, self.rum_structure[j]["utility"], :
-        ]  # pred of alternative j knowing nest m
-        pred_i_m = self.preds_i_m[data_idx, label, :][
-            :, None, :
-        ]  # prediction of choice i knowing nest m
-        pred_m = self.preds_m[:, None, :]  # prediction of choosing nest m
-        pred_i = self._preds[data_idx, label][:, None, None]  # pred of choice i
-        pred_j = self._preds[:, self.rum_structure[j]["utility"]][
-            :, :, None
-        ]  # pred of alt j
-
-        pred_i_m_pred_m = pred_i_m * pred_m
-        pred_j_m_pred_m = pred_j_m * pred_m
-        pred_i_m_pred_i = pred_i_m * pred_i
-        pred_i_m_squared = pred_i_m**2
-        pred_j_m_squared = pred_j_m**2
-        pred_i_squared = pred_i**2
-        pred_j_m_pred_j_squared = (pred_j_m - pred_j) ** 2
-        pred_i_m_1_mu_mu_pred_i = pred_i_m * (1 - self.mu) + self.mu - pred_i
-        pred_j_m_1_mu_pred_j = pred_j_m * (1 - self.mu) - pred_j
-
-        mu_squared = self.mu**2
-
-        d_pred_i_Vi = np.sum(
-            (pred_i_m_pred_m * pred_i_m_1_mu_mu_pred_i), axis=2, keepdims=True
-        )  # first derivative of pred i with respect to Vi
-        d_pred_i_Vj = np.sum(
-            (pred_i_m_pred_m * pred_j_m_1_mu_pred_j), axis=2, keepdims=True
-        )  # first derivative of pred i with respect to Vj
-        d_pred_j_Vj = np.sum(
-            (pred_j_m_pred_m * (pred_j_m_1_mu_pred_j + self.mu)),
-            axis=2,
-            keepdims=True,
-        )  # first derivative of pred j with respect to Vj
-
-        mu_3pim2_3pim_2pimpi_pi = self.mu * (
-            -3 * pred_i_m_squared + 3 * pred_i_m + 2 * (pred_i_m_pred_i - pred_i)
-        )
-        pim2_2pimpi_pi2_dpiVi = (
-            pred_i_m_squared - 2 * pred_i_m_pred_i + pred_i_squared - d_pred_i_Vi
-        )
-        mu2_2pim2_3pim_1 = mu_squared * (2 * pred_i_m_squared - 3 * pred_i_m + 1)
-        mu2_pjm = mu_squared * (-pred_j_m)
-        mu_pjm2_pjm = self.mu * (-pred_j_m_squared + pred_j_m)
-
-        d2_pred_i_Vi = np.sum(
-            (
-                pred_i_m_pred_m
-                * (mu2_2pim2_3pim_1 + mu_3pim2_3pim_2pimpi_pi + pim2_2pimpi_pi2_dpiVi)
-            ),
-            axis=2,
-            keepdims=True,
-        )
-        d2_pred_i_Vj = np.sum(
-            (
-                pred_i_m_pred_m
-                * (mu2_pjm + mu_pjm2_pjm + pred_j_m_pred_j_squared - d_pred_j_Vj)
-            ),
-            axis=2,
-            keepdims=True,
-        )
-
-        # print(d2_pred_i_Vi)
-        mask = np.array(self.rum_structure[j]["utility"])[None, :] == label[:, None]
-        grad = np.where(
-            mask[:, :, None],
-            ((-1 / pred_i) * d_pred_i_Vi),
-            ((-1 / pred_i) * d_pred_i_Vj),
-        )
-        hess = np.where(
-            mask[:, :, None],
-            ((-1 / pred_i**2) * (d2_pred_i_Vi * pred_i - d_pred_i_Vi**2)),
-            ((-1 / pred_i**2) * (d2_pred_i_Vj * pred_i - d_pred_i_Vj**2)),
-        )
-        hess *= factor
+        if numba_installed:
+            grad, hess = _f_obj_cross_nested_numba(
+                label,
+                self.preds_i_m,
+                self.preds_m,
+                self._preds,
+                self.mu,
+                np.array(self.rum_structure[j]["utility"]),
+                factor,
+                *self._grad_hess_buffers(j, label.shape[0]),
+            )
+        else:
+            # arrays are of shape (n_nests, n_obs, n_utility), nests first as preds_i_m
+            mu = self.mu[:, None, None]
+            pred_j_m = self.preds_i_m[
+                :, :, self.rum_structure[j]["utility"]
+            ]  # pred of alternative j knowing nest m
+            pred_i_m = self.preds_i_m[:, data_idx, label][
+                :, :, None
+            ]  # prediction of choice i knowing nest m
+            pred_m = self.preds_m.T[:, :, None]  # prediction of choosing nest m
+            pred_i = self._preds[data_idx, label][None, :, None]  # pred of choice i
+            pred_j = self._preds[:, self.rum_structure[j]["utility"]][
+                None, :, :
+            ]  # pred of alt j
+
+            pred_i_m_pred_m = pred_i_m * pred_m
+            pred_j_m_pred_m = pred_j_m * pred_m
+            pred_i_m_pred_i = pred_i_m * pred_i
+            pred_i_m_squared = pred_i_m**2
+            pred_j_m_squared = pred_j_m**2
+            pred_i_squared = pred_i**2
+            pred_j_m_pred_j_squared = (pred_j_m - pred_j) ** 2
+            pred_i_m_1_mu_mu_pred_i = pred_i_m * (1 - mu) + mu - pred_i
+            pred_j_m_1_mu_pred_j = pred_j_m * (1 - mu) - pred_j
+
+            mu_squared = mu**2
+
+            # sums over nests of products, with einsum to avoid the product
+            # temporaries, keeping a leading nest axis of size one
+            d_pred_i_Vi = np.einsum(
+                "mnu,mnu->nu", pred_i_m_pred_m, pred_i_m_1_mu_mu_pred_i
+            )[None]  # first derivative of pred i with respect to Vi
+            d_pred_i_Vj = np.einsum(
+                "mnu,mnu->nu", pred_i_m_pred_m, pred_j_m_1_mu_pred_j
+            )[None]  # first derivative of pred i with respect to Vj
+            d_pred_j_Vj = np.einsum(
+                "mnu,mnu->nu", pred_j_m_pred_m, pred_j_m_1_mu_pred_j + mu
+            )[None]  # first derivative of pred j with respect to Vj
+
+            mu_3pim2_3pim_2pimpi_pi = mu * (
+                -3 * pred_i_m_squared + 3 * pred_i_m + 2 * (pred_i_m_pred_i - pred_i)
+            )
+            pim2_2pimpi_pi2_dpiVi = (
+                pred_i_m_squared - 2 * pred_i_m_pred_i + pred_i_squared - d_pred_i_Vi
+            )
+            mu2_2pim2_3pim_1 = mu_squared * (2 * pred_i_m_squared - 3 * pred_i_m + 1)
+            mu2_pjm = mu_squared * (-pred_j_m)
+            mu_pjm2_pjm = mu * (-pred_j_m_squared + pred_j_m)
+
+            d2_pred_i_Vi = np.einsum(
+                "mnu,mnu->nu",
+                pred_i_m_pred_m,
+                mu2_2pim2_3pim_1 + mu_3pim2_3pim_2pimpi_pi + pim2_2pimpi_pi2_dpiVi,
+            )[None]
+            d2_pred_i_Vj = np.einsum(
+                "mnu,mnu->nu",
+                pred_i_m_pred_m,
+                mu2_pjm + mu_pjm2_pjm + pred_j_m_pred_j_squared - d_pred_j_Vj,
+            )[None]
+
+            # print(d2_pred_i_Vi)
+            mask = np.array(self.rum_structure[j]["utility"])[None, :] == label[:, None]
+            grad = np.where(
+                mask[None, :, :],
+                ((-1 / pred_i) * d_pred_i_Vi),
+                ((-1 / pred_i) * d_pred_i_Vj),
+            )[0]
+            hess = np.where(
+                mask[None, :, :],
+                ((-1 / pred_i**2) * (d2_pred_i_Vi * pred_i - d_pred_i_Vi**2)),
+                ((-1 / pred_i**2) * (d2_pred_i_Vj * pred_i - d_pred_i_Vj**2)),
+            )[0]
+            hess *= factor
 
         if self.subsample_idx.size < self.num_obs[0]:
             grad_rescaled = np.zeros(
@@ -1156,8 +1235,9 @@ class RUMBoost:
         # compute utilities with corresponding features
         # split data
         new_data, _ = self._preprocess_data(
-            data, return_data=True, free_raw_data=False, construct_datasets=True
+            data, return_data=True, free_raw_data=False
         )
+        num_data = self.num_obs[0]
 
         if self.device is not None:
 
@@ -1169,11 +1249,11 @@ class RUMBoost:
 
             booster_preds = [
                 (
-                    self._linear_predict(k, new_data[k].get_data().reshape(-1))
+                    self._linear_predict(k, new_data[k].data.reshape(-1))
                     if self.boost_from_parameter_space[k]
                     else torch.from_numpy(
                         booster.predict(
-                            new_data[k].get_data(),
+                            new_data[k].data,
                             start_iteration,
                             num_iteration,
                             raw_score,
@@ -1188,12 +1268,12 @@ class RUMBoost:
             ]
             if self.num_classes == 2:
                 raw_preds = torch.zeros(
-                    data.num_data(),
+                    num_data,
                     device=self.device,
                 )
             else:
                 raw_preds = torch.zeros(
-                    data.num_data() * self.num_classes,
+                    num_data * self.num_classes,
                     device=self.device,
                 )
 
@@ -1201,11 +1281,11 @@ class RUMBoost:
             for j, struct in enumerate(self.rum_structure):
                 raw_preds[
                     struct["utility"][0]
-                    * data.num_data() : (struct["utility"][-1] + 1)
-                    * data.num_data()
+                    * num_data : (struct["utility"][-1] + 1)
+                    * num_data
                 ] += booster_preds[j].repeat(len(struct["utility"]))
 
-            raw_preds = raw_preds.view(-1, data.num_data()).T + self.asc
+            raw_preds = raw_preds.view(-1, num_data).T + self.asc
             if self.torch_compile:
                 preds, _, _ = _inner_predict_torch_compiled(
                     raw_preds,
@@ -1236,10 +1316,10 @@ class RUMBoost:
 
         booster_preds = [
             (
-                self._linear_predict(k, new_data[k].get_data().reshape(-1))
+                self._linear_predict(k, new_data[k].data.reshape(-1))
                 if self.boost_from_parameter_space[k]
                 else booster.predict(
-                    new_data[k].get_data(),
+                    new_data[k].data,
                     start_iteration,
                     num_iteration,
                     raw_score,
@@ -1253,17 +1333,17 @@ class RUMBoost:
         ]
 
         if self.num_classes == 2:
-            raw_preds = np.zeros(data.num_data())
+            raw_preds = np.zeros(num_data)
         else:
-            raw_preds = np.zeros((data.num_data() * self.num_classes))
+            raw_preds = np.zeros((num_data * self.num_classes))
         # reshaping raw predictions into num_obs, num_classes array
         for j, struct in enumerate(self.rum_structure):
             idx_ranges = range(
-                struct["utility"][0] * data.num_data(),
-                (struct["utility"][-1] + 1) * data.num_data(),
+                struct["utility"][0] * num_data,
+                (struct["utility"][-1] + 1) * num_data,
             )
             raw_preds[idx_ranges] += booster_preds[j]
-        raw_preds = raw_preds.reshape((data.num_data(), -1), order="F") + self.asc
+        raw_preds = raw_preds.reshape((num_data, -1), order="F") + self.asc
 
         if self.num_classes == 1 and not self.ord_model:  # regression
             return raw_preds
@@ -1432,10 +1512,17 @@ class RUMBoost:
             return raw_preds
 
         if not utilities:
+            # probabilities are computed in the training dtype, since LightGBM
+            # casts the gradients and hessians to float32 anyway
+            raw_preds = raw_preds.astype(self.dtype, copy=False)
+
             # compute nested probabilities. pred_i_m is predictions of choosing i knowing m, pred_m is prediction of choosing nest m and preds is pred_i_m * pred_m
             if self.nests:
                 preds, pred_i_m, pred_m = nest_probs(
-                    raw_preds, mu=self.mu, nests=self.nests, nest_alt=self.nest_alt
+                    raw_preds,
+                    mu=self.mu.astype(self.dtype),
+                    nests=self.nests,
+                    nest_alt=self.nest_alt,
                 )
                 if data_idx == 0:
                     self.preds_i_m = pred_i_m
@@ -1446,7 +1533,9 @@ class RUMBoost:
             # compute cross-nested probabilities. pred_i_m is predictions of choosing i knowing m, pred_m is prediction of choosing nest m and preds is pred_i_m * pred_m
             if self.alphas is not None:
                 preds, pred_i_m, pred_m = cross_nested_probs(
-                    raw_preds, mu=self.mu, alphas=self.alphas
+                    raw_preds,
+                    mu=self.mu.astype(self.dtype),
+                    alphas=self.alphas.astype(self.dtype),
                 )
                 if data_idx == 0:
                     self.preds_i_m = pred_i_m
@@ -1485,6 +1574,7 @@ class RUMBoost:
         free_raw_data: bool = True,
         construct_datasets: bool = False,
         predictor: list[Booster] = None,
+        lgb_params: Optional[Dict[str, Any]] = None,
     ):
         """Set up J training (and, if specified, validation) datasets.
 
@@ -1492,7 +1582,8 @@ class RUMBoost:
         ----------
         data : Dataset
             The full training dataset (i.e. the union of the socio-economic features with the alternative-specific features).
-            Note, the argument free_raw_data shall be set to False when creating the dataset.
+            The dataset does not need to be constructed, and can be created with free_raw_data=True
+            as long as it (or the Dataset it is a subset of) has not been constructed.
         reduced_valid_set : Dataset or list of Dataset, optional (default = None)
             The full dataset used for validation. There can be several datasets.
         return_data : bool, optional (default = False)
@@ -1503,6 +1594,9 @@ class RUMBoost:
             If True, the datasets are constructed.
         predictor : list of Booster, optional (default=None)
             The list of predictors to be used for the datasets.
+        lgb_params : dict, optional (default=None)
+            LightGBM parameters added to the boosting parameters of every dataset,
+            unless already specified in them (e.g. verbosity).
 
         Returns
         -------
@@ -1515,18 +1609,20 @@ class RUMBoost:
         reduced_valid_sets_J = []
         self.valid_labels = []
 
-        # to access data
-        data.construct()
-        self.num_obs = [data.num_data()]  # saving number of observations
+        # to access raw data, without binning the full datasets
+        raw_data, labels = _get_raw_data_and_label(data)
+        self.num_obs = [raw_data.shape[0]]  # saving number of observations
+        raw_valid_data = []
         if reduced_valid_set:
             for valid_set in reduced_valid_set:
-                valid_set.construct()
-                self.num_obs.append(valid_set.num_data())
+                raw_valid, valid_labels = _get_raw_data_and_label(valid_set)
+                raw_valid_data.append(raw_valid)
+                self.num_obs.append(raw_valid.shape[0])
                 self.valid_labels.append(
-                    valid_set.get_label().astype(np.int32)
+                    np.asarray(valid_labels, dtype=np.int32)
                 )  # saving labels
 
-        self.labels = data.get_label().astype(np.int32)  # saving labels
+        self.labels = np.asarray(labels, dtype=np.int32)  # saving labels
         self.labels_j = (
             self.labels[:, None] == np.array(range(self.num_classes))[None, :]
         ).astype(np.int8)
@@ -1537,13 +1633,25 @@ class RUMBoost:
             for val_labs in self.valid_labels
         ]
 
+        # first dataset built for given features and boosting parameters
+        binned_sets = {}
+
         # loop over all J utilities
         for j, struct in enumerate(self.rum_structure):
             if struct:
                 if "variables" in struct:
-                    train_set_j_data = data.get_data()[
-                        struct["variables"]
-                    ]  # only relevant features for the jth booster
+                    # boosters with the same features, number of utilities and boosting
+                    # parameters reuse the bin mappers of the first dataset built with them
+                    binned_key = (
+                        tuple(struct["variables"]),
+                        struct["shared"],
+                        len(struct["utility"]),
+                    )
+                    binned_params, reference_j = binned_sets.get(
+                        binned_key, (None, None)
+                    )
+                    if binned_params != struct["boosting_params"]:
+                        reference_j = None
 
                     if struct["shared"] == True:
                         new_label = self.labels_j[:, struct["utility"]].reshape(
@@ -1556,19 +1664,28 @@ class RUMBoost:
                         )
                         feature_names = struct["variables"]
                     train_set_j = Dataset(
-                        train_set_j_data.values.reshape(
-                            (len(new_label), -1), order="A"
-                        ),
+                        _as_numpy(
+                            raw_data, struct["variables"], len(new_label)
+                        ),  # only relevant features for the jth booster
                         label=new_label,
                         free_raw_data=free_raw_data,
+                        reference=reference_j,
                     )  # create and build dataset
+                    if reference_j is None:
+                        binned_sets[binned_key] = (
+                            struct["boosting_params"],
+                            train_set_j,
+                        )
                     categorical_feature = struct["boosting_params"].get(
                         "categorical_feature", "auto"
                     )
                     predictor_j = predictor[j] if predictor else None
-                    train_set_j._update_params(
-                        struct["boosting_params"]
-                    )._set_predictor(predictor_j).set_feature_name(
+                    dataset_params = _complete_params(
+                        struct["boosting_params"], lgb_params
+                    )
+                    train_set_j._update_params(dataset_params)._set_predictor(
+                        predictor_j
+                    ).set_feature_name(
                         feature_names
                     ).set_categorical_feature(
                         categorical_feature
@@ -1580,11 +1697,6 @@ class RUMBoost:
                         reduced_valid_sets_j = []
                         for i, valid_set in enumerate(reduced_valid_set):
                             # create and build validation sets
-                            valid_set.construct()
-                            valid_set_j_data = valid_set.get_data()[
-                                struct["variables"]
-                            ]  # only relevant features for the jth booster
-
                             if struct["shared"] == True:
                                 label_valid = val_labels_j[i][
                                     :, struct["utility"]
@@ -1594,16 +1706,17 @@ class RUMBoost:
                                     :, struct["utility"][0]
                                 ].reshape(-1, order="F")
                             valid_set_j = Dataset(
-                                valid_set_j_data.values.reshape(
-                                    (len(label_valid), -1),
-                                    order="A",
-                                ),
+                                _as_numpy(
+                                    raw_valid_data[i],
+                                    struct["variables"],
+                                    len(label_valid),
+                                ),  # only relevant features for the jth booster
                                 label=label_valid,
                                 free_raw_data=free_raw_data,
                                 reference=train_set_j,
                             )  # create and build dataset
                             valid_set_j._update_params(
-                                struct["boosting_params"]
+                                dataset_params
                             )._set_predictor(predictor_j)
                             if construct_datasets:
                                 valid_set_j.construct()
@@ -1612,9 +1725,11 @@ class RUMBoost:
 
                 else:
                     # if no alternative specific datasets
-                    new_label = np.where(data.get_label() == j, 1, 0)
+                    new_label = np.where(self.labels == j, 1, 0)
                     train_set_j = Dataset(
-                        data.get_data(), label=new_label, free_raw_data=free_raw_data
+                        _as_numpy(raw_data),
+                        label=new_label,
+                        free_raw_data=free_raw_data,
                     )
                     if reduced_valid_set is not None:
                         reduced_valid_sets_j = reduced_valid_set[:]
@@ -1697,6 +1812,7 @@ class RUMBoost:
         train_data_name="Training",
         is_valid_contain_train=False,
         name_valid_sets=["Valid_0"],
+        lgb_params=None,
     ):
         """Construct boosters of the RUMBoost model with corresponding set of parameters, training datasets, and validation sets and store them in the RUMBoost object.
 
@@ -1710,6 +1826,9 @@ class RUMBoost:
             List of names of validation sets.
         init_models : list of Booster, optional (default=None)
             The list of initial models to be used for the boosters.
+        lgb_params : dict, optional (default=None)
+            LightGBM parameters added to the boosting parameters of every booster,
+            unless already specified in them (e.g. verbosity).
         """
         booster_train_idx = []
         if self.valid_sets is not None:
@@ -1717,11 +1836,13 @@ class RUMBoost:
         for j, struct in enumerate(self.rum_structure):
             # construct booster and perform basic preparations
             try:
-                params = copy.deepcopy(struct["boosting_params"])
+                # Booster already copies its params, so they are only copied
+                # here when they need to be modified
+                params = _complete_params(struct["boosting_params"], lgb_params)
                 if self.boost_from_parameter_space[j]:
-                    params["monotone_constraints"] = [
-                        0
-                    ]  # in case of boosting from parameter, monotonicity is removed
+                    params = dict(
+                        params, monotone_constraints=[0]
+                    )  # in case of boosting from parameter, monotonicity is removed
                 booster = Booster(
                     params=params,
                     train_set=self.train_set[j],
@@ -1732,7 +1853,9 @@ class RUMBoost:
                         (struct["utility"][-1] + 1) * self.num_obs[0],
                     ]
                 else:
-                    idx_ranges = range(
+                    # slices are reused at each round, whereas ranges would be
+                    # converted to index arrays and used for fancy indexing
+                    idx_ranges = slice(
                         struct["utility"][0] * self.num_obs[0],
                         (struct["utility"][-1] + 1) * self.num_obs[0],
                     )
@@ -1749,7 +1872,7 @@ class RUMBoost:
                                 (struct["utility"][-1] + 1) * self.num_obs[i + 1],
                             ]
                         else:
-                            idx_ranges = range(
+                            idx_ranges = slice(
                                 struct["utility"][0] * self.num_obs[i + 1],
                                 (struct["utility"][-1] + 1) * self.num_obs[i + 1],
                             )
@@ -2168,7 +2291,7 @@ class RUMBoost:
             )
         if self.device is not None:
             if self.labels_j is not None:
-                labels_j_numpy = [l.cpu().numpy().tolist() for l in self.labels_j]
+                labels_j_numpy = self.labels_j.cpu().numpy().tolist()
             else:
                 labels_j_numpy = []
             if self.valid_labels is not None:
@@ -2228,7 +2351,7 @@ class RUMBoost:
             }
         else:
             if self.labels_j is not None:
-                labels_j_list = [l.tolist() for l in self.labels_j]
+                labels_j_list = self.labels_j.tolist()
             else:
                 labels_j_list = []
             if self.valid_labels is not None:
@@ -2393,18 +2516,20 @@ def rum_train(
     keep_training_booster: bool = False,
     callbacks: Optional[list[Callable]] = None,
     torch_tensors: dict = None,
+    dtype: np.dtype = np.float32,
 ) -> RUMBoost:
     """Perform the RUM training with given parameters.
 
     Parameters
     ----------
     train_set : Dataset or dict[int, Any]
-        Data to be trained on. Set free_raw_data=False when creating the dataset. If it is
+        Data to be trained on. The dataset can be created with free_raw_data=True, as long
+        as it (or the Dataset it is a subset of) has not been constructed. If it is
         a dictionary, the key-value pairs should be:
             - "train_sets":  the corresponding preprocessed Dataset.
             - "num_data": the number of observations in the dataset.
             - "labels": the labels of the full dataset.
-            - "labels_j": the labels of the dataset for each class (binary).
+            - "labels_j": the one-hot encoded labels, of shape (num_data, num_classes).
     model_specification : dict
         Dictionary specifying the model specification. The required keys are:
 
@@ -2432,6 +2557,11 @@ def rum_train(
                         Verbosity of the model.
                     - 'verbose_interval': int, optional (default = 10)
                         Interval of the verbosity display. only used if verbosity > 1.
+                    - 'num_parallel_boosters': int, optional (default = 1)
+                        Number of boosters updated concurrently at each round, in separate threads.
+                        If greater than 1, the threads given by num_threads (by default, all the
+                        cores available) are shared between these boosters, unless num_threads
+                        is already specified in their boosting_params.
                     - 'max_booster_to_update': int, optional (default = num_classes)
                         Maximum number of boosters to update at each round. It has to be
                         at least equal to the number of classes, and at most equal to
@@ -2598,6 +2728,11 @@ def rum_train(
             'torch_compile': bool
                 If True, the prediction, objective function and cross-entropy calculations will be compiled with torch.compile.
                 If used with GPU or cuda, it requires to be on a linux os.
+    dtype : numpy dtype, optional (default=np.float32)
+        The dtype of the probabilities used to compute the gradients and hessians during training,
+        when torch tensors are not used. LightGBM casts the gradients and hessians to float32,
+        but np.float64 can be used for ill-conditioned models. Predictions from ``predict`` are
+        not affected.
 
     Note
     ----
@@ -2633,10 +2768,12 @@ def rum_train(
     save_model_interval = params.get("save_model_interval", 0)
 
     # check if verbosity is in params
+    lgb_params = {}  # general parameters passed to the datasets and boosters
     for alias in _ConfigAliases.get("verbosity"):
         if alias in params:
             verbosity = params[alias]
             verbose_interval = params.get("verbose_interval", 10)
+            lgb_params["verbosity"] = verbosity
 
     # create predictor first
     params = copy.deepcopy(params)
@@ -2707,7 +2844,7 @@ def rum_train(
     callbacks_after_iter = sorted(callbacks_after_iter_set, key=attrgetter("order"))
 
     # construct rumboost object
-    rumb = RUMBoost()
+    rumb = RUMBoost(dtype=dtype)
 
     if torch_tensors:
         if not torch_installed:
@@ -2716,6 +2853,10 @@ def rum_train(
             )
         dev_str = torch_tensors.get("device", "cpu")
         rumb.torch_compile = torch_tensors.get("torch_compile", False)
+        if rumb.torch_compile and not torch_compile_supported:
+            _log_warning(
+                "torch.compile is not supported by this version of torch and python. Running functions without compilation."
+            )
         if dev_str == "cuda":
             rumb.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         elif dev_str == "gpu":
@@ -2777,6 +2918,17 @@ def rum_train(
 
     rumb.batch_size = params.get("batch_size", 0)
 
+    num_parallel_boosters = params.get("num_parallel_boosters", 1)
+    if num_parallel_boosters > 1:
+        # share the threads between the boosters updated concurrently: the ones
+        # given by the user, or by default all the cores available to the process
+        num_threads = _choose_param_value(
+            main_param_name="num_threads", params=params, default_value=0
+        )["num_threads"]
+        if num_threads <= 0:
+            num_threads = _available_cpu_count()
+        lgb_params["num_threads"] = max(1, num_threads // num_parallel_boosters)
+
     # additional parameters to compete for best booster
     rumb.additional_params_idx = []
 
@@ -3074,8 +3226,7 @@ def rum_train(
                         "Feature interaction is not implemented when boosting from the parameter space, please set max_depth to 1."
                     )
                 feature = struct["variables"][0]
-                train_set.construct()
-                data = train_set.get_data()[feature]
+                data = _get_raw_data_and_label(train_set)[0][feature]
                 rumb.split_and_leaf_values[j] = {
                     "splits": np.array([data.min(), data.max()]),
                     "constants": np.array([0.0, 0.0]),
@@ -3103,7 +3254,7 @@ def rum_train(
         ]  # assign the J previously preprocessed datasets
         rumb.labels = train_set["labels"]
         if rumb.mu is None and rumb.ord_model is None and rumb.num_classes > 2:
-            if not train_set.get("labels_j", None):
+            if train_set.get("labels_j", None) is None:
                 rumb.labels_j = (
                     rumb.labels[:, None] == np.array(range(rumb.num_classes))[None, :]
                 ).astype(np.int8)
@@ -3152,12 +3303,15 @@ def rum_train(
             reduced_valid_sets,
             predictor=predictor,
             free_raw_data=free_raw_data,
+            lgb_params=lgb_params,
         )  # prepare J datasets with relevant features
         if rumb.mu is not None or rumb.ord_model or rumb.num_classes < 3:
             rumb.labels_j = None
 
     # create J boosters with corresponding params and datasets
-    rumb._construct_boosters(train_data_name, is_valid_contain_train, name_valid_sets)
+    rumb._construct_boosters(
+        train_data_name, is_valid_contain_train, name_valid_sets, lgb_params
+    )
 
     # free datasets from memory
     if not any(rumb.boost_from_parameter_space):
@@ -3324,7 +3478,10 @@ def rum_train(
     for i in range(init_iteration, init_iteration + num_boost_round):
         # initialising the current predictions
         rumb._current_gains = []
-        # update all binary boosters of the rumb
+        temp_gains = []
+        grad_hess = []
+        # gradients and hessians of all binary boosters of the rumb,
+        # they only depend on the predictions of the previous round
         for j, booster in enumerate(rumb.boosters):
             for cb in callbacks_before_iter:
                 cb(
@@ -3342,14 +3499,22 @@ def rum_train(
             rumb._current_j = j
 
             # initial gain
-            temp_gain = booster.feature_importance("gain").sum()
+            temp_gains.append(booster.feature_importance("gain").sum())
 
-            # update the booster
-            booster.update(train_set=None, fobj=f_obj)
+            grad_hess.append(f_obj(None, None))
 
+        # update all binary boosters of the rumb
+        _update_boosters(
+            rumb.boosters,
+            grad_hess,
+            num_parallel_boosters,
+            lgb_params.get("verbosity"),
+        )
+
+        for j, booster in enumerate(rumb.boosters):
             # store update gain
             rumb._current_gains.append(
-                (booster.feature_importance("gain").sum() - temp_gain)
+                (booster.feature_importance("gain").sum() - temp_gains[j])
                 / (
                     rumb.num_obs[0] * len(rumb.rum_structure[j]["variables"])
                 )  # we normalise with the full number of observations even when not predicting for all alternatives since the gradient are summed in the objective function
@@ -3400,6 +3565,18 @@ def rum_train(
                     params_to_optimise += rumb.alphas.cpu().numpy().flatten().tolist()
                 else:
                     params_to_optimise += rumb.alphas.flatten().tolist()
+            # the subsampled raw predictions do not change during the optimisation,
+            # so they are gathered once instead of at each evaluation of the loss
+            if rumb.device is not None:
+                subsample_raw_preds = (
+                    rumb.raw_preds.view(-1, rumb.num_obs[0])
+                    .T[rumb.subsample_idx, :]
+                    .type(torch.double)
+                )
+            else:
+                subsample_raw_preds = rumb.raw_preds.reshape(
+                    rumb.num_obs[0], -1, order="F"
+                )[rumb.subsample_idx, :]
             # update mu
             res = minimize(
                 optimise_mu_or_alpha,
@@ -3410,6 +3587,7 @@ def rum_train(
                     optimise_mu,
                     optimise_alphas,
                     alpha_shape,
+                    subsample_raw_preds,
                 ),
                 bounds=bounds,
                 method="SLSQP",
@@ -3569,6 +3747,8 @@ def rum_train(
         if save_model_interval > 0 and (i % save_model_interval == 0):
             rumb.save_model(f"models/MTMC_switzerland_CNL_gpu_{i}")
 
+    rumb._grad_hess_buf = {}
+
     for booster in rumb.boosters:
         booster.best_score_lgb = collections.defaultdict(collections.OrderedDict)
         for dataset_name, eval_name, score, _ in evaluation_result_list:
@@ -3578,6 +3758,71 @@ def rum_train(
     return rumb
 
 
+def _complete_params(
+    params: Dict[str, Any], lgb_params: Optional[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """Add the parameters of lgb_params that are not in params, under any alias, to a copy of params."""
+    missing_params = {
+        name: value
+        for name, value in (lgb_params or {}).items()
+        if not any(alias in params for alias in _ConfigAliases.get(name))
+    }
+    if not missing_params:
+        return params
+    return dict(params, **missing_params)
+
+
+def _available_cpu_count() -> int:
+    """Number of cores available to the process, following its CPU affinity and cgroup quota."""
+    if hasattr(os, "process_cpu_count"):  # python >= 3.13
+        num_cpus = os.process_cpu_count() or 1
+    elif hasattr(os, "sched_getaffinity"):
+        num_cpus = len(os.sched_getaffinity(0))
+    else:
+        num_cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as file:
+            quota, period = file.read().split()
+        if quota != "max":
+            num_cpus = min(num_cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return num_cpus
+
+
+def _set_lgb_verbosity(verbosity: int):
+    """Set the LightGBM log level of the current thread, as LightGBM stores it per thread."""
+    # parsing a config with the verbosity resets the log level of the thread
+    _get_sample_count(1, f"verbosity={verbosity}")
+
+
+def _update_booster(booster: Booster, grad_hess: Tuple[np.ndarray, np.ndarray]):
+    """Update a booster for one round, with its precomputed gradient and hessian."""
+    return booster.update(train_set=None, fobj=lambda _, __: grad_hess)
+
+
+def _update_boosters(
+    boosters: List[Booster],
+    grad_hess: List[Tuple[np.ndarray, np.ndarray]],
+    num_parallel_boosters: int = 1,
+    verbosity: Optional[int] = None,
+):
+    """Update the boosters for one round, with their precomputed gradients and hessians.
+
+    If num_parallel_boosters > 1, they are updated in threads, as LightGBM releases the
+    GIL while growing trees. The threads live for the round only, so that they are always
+    released, and their LightGBM log level is set to verbosity.
+    """
+    if num_parallel_boosters <= 1:
+        return list(map(_update_booster, boosters, grad_hess))
+    with ThreadPoolExecutor(
+        max_workers=num_parallel_boosters,
+        initializer=_set_lgb_verbosity if verbosity is not None else None,
+        initargs=(verbosity,) if verbosity is not None else (),
+    ) as executor:
+        return list(executor.map(_update_booster, boosters, grad_hess))
+
+
 class CVRUMBoost:
     """CVRUMBoost in LightGBM.
 
@@ -3635,6 +3880,9 @@ def _make_n_folds(
     biogeme_model=None,
 ):
     """Make a n-fold list of Booster from random indices."""
+    # the datasets of the folds are built from the raw data of their subset,
+    # so it must be kept when constructing the full dataset
+    full_data.free_raw_data = False
     full_data = full_data.construct()
     num_data = full_data.num_data()
     if folds is not None:
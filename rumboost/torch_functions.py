@@ -1,19 +1,24 @@
 import numpy as np
-import sys
 
 try:
     import torch
 
     torch_installed = True
-    if sys.version_info > (3, 11):
-        compile_decorator = lambda func: func
-        Warning(
-            "RuntimeError: Torch.compile is not supported in python 3.12. Running functions without compilation."
-        )
-    else:
-        compile_decorator = torch.compile
 except ImportError:
     torch_installed = False
+
+try:
+    from torch._dynamo import is_dynamo_supported
+
+    # torch.compile supports python 3.12 from torch 2.4, so check the running
+    # python against the installed torch rather than a fixed python version
+    torch_compile_supported = is_dynamo_supported()
+except ImportError:
+    torch_compile_supported = False
+
+if torch_compile_supported:
+    compile_decorator = torch.compile
+else:
     compile_decorator = lambda func: func
 
 
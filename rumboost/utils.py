@@ -1,4 +1,5 @@
 import numpy as np
+import pandas as pd
 from rumboost.metrics import cross_entropy
 from scipy.special import softmax
 
@@ -425,6 +426,46 @@ def sort_dict(dict_to_sort):
 
     return dict_sorted
     
+def _get_raw_data_and_label(dataset):
+    """
+    Get the raw data and the labels of a lightgbm Dataset.
+
+    The raw data is read directly from the Dataset, so that it does not need to be
+    constructed (i.e. binned), and it can be created with free_raw_data=True as long as
+    it has not been constructed. Subsets of a Dataset read their raw data from their
+    reference, which must not have been freed either.
+
+    Parameters
+    ----------
+    dataset : Dataset
+        The lightgbm Dataset.
+
+    Returns
+    -------
+    raw_data : pandas DataFrame or numpy array
+        The raw data of the dataset.
+    label : numpy array
+        The labels of the dataset.
+    """
+    if dataset.data is None and dataset.used_indices is not None:
+        # subset of a Dataset, slice the raw data and labels of its reference
+        raw_data, label = _get_raw_data_and_label(dataset.reference)
+        if isinstance(raw_data, pd.DataFrame):
+            raw_data = raw_data.iloc[dataset.used_indices]
+        else:
+            raw_data = raw_data[dataset.used_indices]
+        return raw_data, np.asarray(label)[dataset.used_indices]
+
+    if dataset.data is None:
+        raise ValueError(
+            "The raw data of the Dataset has been freed when constructing it. "
+            "Create the Dataset with free_raw_data=False, or do not construct it "
+            "before training."
+        )
+
+    return dataset.data, dataset.get_label()
+
+
 def _check_rum_structure(rum_structure):
     """ Check that rum_structure, a list of dictionaries, is of the correct format. """
 
@@ -1,7 +1,13 @@
+import copy
 import pytest
 import rumboost as rumb
 from rumboost.rumboost import rum_train
-from rumboost.datasets import prepare_dataset
+from rumboost.datasets import prepare_dataset, _as_numpy
+from rumboost.nested_cross_nested import (
+    nest_probs,
+    cross_nested_probs,
+    optimise_mu_or_alpha,
+)
 import numpy as np
 import pandas as pd
 from lightgbm import Dataset, Booster
@@ -13,6 +19,94 @@ try:
 except ImportError:
     TORCH_INSTALLED = False
 
+try:
+    import numba
+
+    NUMBA_INSTALLED = True
+except ImportError:
+    NUMBA_INSTALLED = False
+
+# immutable arrays shared by the fixtures, to avoid rebuilding them for each test
+_ALPHAS = np.array([[0.5, 0.5], [1, 0], [0, 1]])
+_MU = np.array([1, 1])
+_OPTIMISE_ALPHAS = np.array([[True, True], [False, False], [False, False]])
+_NEST_ALT = np.array([0, 0, 1])
+_LABELS = np.array([0, 1, 2, 1])
+_LABELS_J = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1], [0, 1, 0]], dtype=np.int8)
+_VALID_LABELS = np.array([2, 1, 0])
+# boosting parameters of the alternative-specific boosters, referenced by all of them
+_UTIL_BOOST_PARAMS = {
+    "monotone_constraints_method": "advanced",
+    "monotone_constraints": [1, -1],
+    "interaction_constraints": [[0], [1]],
+    "learning_rate": 0.1,
+    "max_depth": 1,
+    "min_data_in_leaf": 1,
+    "min_gain_to_split": 0,
+}
+# model-specific parts of the specifications built by create_model_spec, with mu != 1
+# so that the nested models differ from the MNL, and mu and alphas optimised during
+# training
+_SPEC_MU = np.array([1.5, 1.0])
+_NESTED_LOGIT = {
+    "mu": _SPEC_MU,
+    "nests": {0: [0, 1], 1: [2]},
+    "optimise_mu": [True, False],
+    "optim_interval": 5,
+}
+_CROSS_NESTED_LOGIT = {
+    "mu": _SPEC_MU,
+    "alphas": _ALPHAS,
+    "optimise_mu": [True, False],
+    "optimise_alphas": _OPTIMISE_ALPHAS,
+    "optim_interval": 5,
+}
+# specification and expected best scores and validation predictions of each model type
+_MODEL_SPECS = {
+    "MNL": (
+        {},
+        (
+            1.1686095148959108,
+            0.6433719740056012,
+            np.array(
+                [
+                    [0.32064655, 0.54756162, 0.13179183],
+                    [0.16579322, 0.28312173, 0.55108505],
+                    [0.16579322, 0.28312173, 0.55108505],
+                ]
+            ),
+        ),
+    ),
+    "Nested Logit": (
+        {"nested_logit": _NESTED_LOGIT},
+        (
+            1.1731821342910116,
+            0.7163746214261945,
+            np.array(
+                [
+                    [0.34549491, 0.47518125, 0.17932384],
+                    [0.14988108, 0.20614103, 0.64397789],
+                    [0.14988108, 0.20614103, 0.64397789],
+                ]
+            ),
+        ),
+    ),
+    "Cross Nested Logit": (
+        {"cross_nested_logit": _CROSS_NESTED_LOGIT},
+        (
+            1.1646595825634192,
+            0.7736451287147921,
+            np.array(
+                [
+                    [0.34731164, 0.42946316, 0.2232252],
+                    [0.1474658, 0.18234668, 0.67018752],
+                    [0.1474658, 0.18234668, 0.67018752],
+                ]
+            ),
+        ),
+    ),
+}
+
 
 @pytest.fixture
 def toy_train_set():
@@ -25,10 +119,11 @@ def toy_train_set():
                 "3": [4, 5, 6, 1],
                 "4": [3, 1, 7, 3],
                 "5": [6, 1, 3, 9],
-            }
+            },
+            dtype=np.float32,
         ),
-        label=pd.Series([0, 1, 2, 1], dtype=int),
-        free_raw_data=False,
+        label=np.array([0, 1, 2, 1], dtype=np.int32),
+        free_raw_data=True,
     )
 
 
@@ -43,39 +138,35 @@ def toy_valid_set():
                 "3": [1, 6, 8],
                 "4": [7, 5, 4],
                 "5": [3, 2, 1],
-            }
+            },
+            dtype=np.float32,
         ),
-        label=pd.Series([2, 1, 0], dtype=int),
-        free_raw_data=False,
+        label=np.array([2, 1, 0], dtype=np.int32),
+        free_raw_data=True,
     )
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def toy_attributes():
     return {
         "best_iteration": 100,
         "best_score": 0.5,
         "best_score_train": 0.3,
-        "alphas": np.array([[0.5, 0.5], [1, 0], [0, 1]]),
-        "mu": np.array([1, 1]),
+        "alphas": _ALPHAS,
+        "mu": _MU,
         "optimise_mu": [True, False],
-        "optimise_alphas": np.array([[True, True], [False, False], [False, False]]),
+        "optimise_alphas": _OPTIMISE_ALPHAS,
         "optim_interval": 20,
         "nests": {0: [0, 1], 1: [2]},
-        "nest_alt": np.array([0, 0, 1]),
+        "nest_alt": _NEST_ALT,
         "num_classes": 3,
         "num_obs": [4, 3],
         "functional_effects": False,
         "shared_ensembles": {3: [0, 1, 2]},
         "shared_start_idx": 3,
-        "labels": np.array([0, 1, 2, 1]),
-        "labels_j": [
-            np.array([1, 0, 0]),
-            np.array([0, 1, 0]),
-            np.array([0, 0, 1]),
-            np.array([0, 1, 0]),
-        ],
-        "valid_labels": np.array([2, 1, 0]),
+        "labels": _LABELS,
+        "labels_j": _LABELS_J,
+        "valid_labels": _VALID_LABELS,
         "device": None,
         "torch_compile": False,
         "general_params": {
@@ -95,95 +186,44 @@ def toy_attributes():
         },
         "rum_structure": [
             {
-                "utility": [0],
-                "variables": ["0", "1"],
-                "boosting_params": {
-                    "monotone_constraints_method": "advanced",
-                    "monotone_constraints": [1, -1],
-                    "interaction_constraints": [[0], [1]],
-                    "learning_rate": 0.1,
-                    "max_depth": 1,
-                    "min_data_in_leaf": 1,
-                    "min_gain_to_split": 0,
-                },
-                "shared": False,
-            },
-            {
-                "utility": [1],
-                "variables": ["1", "2"],
-                "boosting_params": {
-                    "monotone_constraints_method": "advanced",
-                    "monotone_constraints": [1, -1],
-                    "interaction_constraints": [[0], [1]],
-                    "learning_rate": 0.1,
-                    "max_depth": 1,
-                    "min_data_in_leaf": 1,
-                    "min_gain_to_split": 0,
-                },
-                "shared": False,
-            },
-            {
-                "utility": [2],
-                "variables": ["0", "2"],
-                "boosting_params": {
-                    "monotone_constraints_method": "advanced",
-                    "monotone_constraints": [1, -1],
-                    "interaction_constraints": [[0], [1]],
-                    "learning_rate": 0.1,
-                    "max_depth": 1,
-                    "min_data_in_leaf": 1,
-                    "min_gain_to_split": 0,
-                },
+                "utility": [u],
+                "variables": variables,
+                "boosting_params": _UTIL_BOOST_PARAMS,
                 "shared": False,
-            },
+            }
+            for u, variables in enumerate([["0", "1"], ["1", "2"], ["0", "2"]])
+        ]
+        + [
             {
                 "utility": [0, 1, 2],
                 "variables": ["3", "4", "5"],
-                "boosting_params": {
-                    "monotone_constraints_method": "advanced",
-                    "monotone_constraints": [1],
-                    "interaction_constraints": [[0]],
-                    "learning_rate": 0.1,
-                    "max_depth": 1,
-                    "min_data_in_leaf": 1,
-                    "min_gain_to_split": 0,
-                },
+                "boosting_params": dict(
+                    _UTIL_BOOST_PARAMS,
+                    monotone_constraints=[1],
+                    interaction_constraints=[[0]],
+                ),
                 "shared": True,
             },
         ],
     }
 
 
-@pytest.fixture
-def create_model_spec(model_type="MNL", toy_attributes=toy_attributes):
+@pytest.fixture(params=list(_MODEL_SPECS), scope="module")
+def create_model_spec(request, toy_attributes):
     """
-    Create a model specification for the RUMBoost object
+    Create a model specification for the RUMBoost object, once per model type,
+    with its expected best scores and validation predictions.
     Model_type can be "MNL", "Nested Logit" or "Cross Nested Logit"
     """
-    if "num_classes" not in toy_attributes["general_params"]:
-        toy_attributes["general_params"]["num_classes"] = 3
-    model_specification = {
-        "general_params": toy_attributes["general_params"],
-        "rum_structure": toy_attributes["rum_structure"],
-    }
-    if model_type == "Nested Logit":
-        model_specification["nested_logit"] = {
-            "mu": toy_attributes["mu"],
-            "nests": toy_attributes["nests"],
-            "optimise_mu": toy_attributes["optimise_mu"],
-            "optim_interval": toy_attributes["optim_interval"],
-        }
-        return model_specification
-    elif model_type == "Cross Nested Logit":
-        model_specification["cross_nested_logit"] = {
-            "mu": toy_attributes["mu"],
-            "alphas": toy_attributes["alphas"],
-            "optimise_mu": toy_attributes["optimise_mu"],
-            "optimise_alphas": toy_attributes["optimise_alphas"],
-            "optim_interval": toy_attributes["optim_interval"],
+    model_spec, expected_results = _MODEL_SPECS[request.param]
+    model_specification = copy.deepcopy(
+        {
+            "general_params": toy_attributes["general_params"],
+            "rum_structure": toy_attributes["rum_structure"],
+            **model_spec,
         }
-        return model_specification
-    return model_specification
+    )
+    return model_specification, expected_results
 
 
 @pytest.fixture
@@ -204,12 +244,14 @@ def test_rumboost_object(toy_train_set, toy_valid_set, toy_attributes):
 
     # create a rumboost object
     model = rumb.RUMBoost(model_file=None, **toy_attributes)
-    num_classes = toy_attributes["general_params"].pop("num_classes")
-    toy_train_set._update_params(toy_attributes["general_params"])._set_predictor(
+    # toy_attributes is shared by the module, so do not mutate it
+    general_params = copy.deepcopy(toy_attributes["general_params"])
+    general_params.pop("num_classes")
+    toy_train_set._update_params(general_params)._set_predictor(
         None
     ).set_feature_name(None).set_categorical_feature([])
     reduced_valid_sets, _, _, _ = model._preprocess_valids(
-        toy_train_set, toy_attributes["general_params"], [toy_valid_set]
+        toy_train_set, general_params, [toy_valid_set]
     )  # prepare validation sets
     model._preprocess_data(toy_train_set, reduced_valid_sets)
     model.boosters = [
@@ -239,20 +281,18 @@ def test_rumboost_object(toy_train_set, toy_valid_set, toy_attributes):
     assert model.shared_ensembles == {3: [0, 1, 2]}
     assert model.num_obs == [4, 3]
     assert model.nests == {0: [0, 1], 1: [2]}
-    assert np.array_equal(model.nest_alt, np.array([0, 0, 1]))
-    assert np.array_equal(model.mu, np.array([1, 1]))
-    assert np.array_equal(model.alphas, np.array([[0.5, 0.5], [1, 0], [0, 1]]))
-    assert np.array_equal(model.labels, np.array([0, 1, 2, 1]))
-    assert np.array_equal(
-        model.labels_j,
-        [
-            np.array([1, 0, 0]),
-            np.array([0, 1, 0]),
-            np.array([0, 0, 1]),
-            np.array([0, 1, 0]),
-        ],
-    )
-    assert np.array_equal(model.valid_labels, [np.array([2, 1, 0])])
+    # compare with the prebuilt module arrays, without coercing lists to arrays
+    assert model.nest_alt.shape == _NEST_ALT.shape
+    assert (model.nest_alt == _NEST_ALT).all()
+    assert model.mu.shape == _MU.shape and (model.mu == _MU).all()
+    assert model.alphas.shape == _ALPHAS.shape and (model.alphas == _ALPHAS).all()
+    assert model.labels.shape == _LABELS.shape and (model.labels == _LABELS).all()
+    assert model.labels_j.dtype == np.int8
+    assert model.labels_j.shape == _LABELS_J.shape
+    assert (model.labels_j == _LABELS_J).all()
+    assert len(model.valid_labels) == 1
+    assert model.valid_labels[0].shape == _VALID_LABELS.shape
+    assert (model.valid_labels[0] == _VALID_LABELS).all()
     assert model.rum_structure == toy_attributes["rum_structure"]
     assert model.device == None
     assert model.torch_compile == False
@@ -262,7 +302,7 @@ def test_simple_train(
     create_model_spec, create_torch_tensors, toy_train_set, toy_valid_set
 ):
     print(toy_train_set.data)
-    model_specification = create_model_spec
+    model_specification, expected_results = create_model_spec
     torch_tensors = create_torch_tensors
     model_trained = rum_train(
         toy_train_set,
@@ -270,33 +310,297 @@ def test_simple_train(
         valid_sets=[toy_valid_set],
         torch_tensors=torch_tensors,
     )
-    assert model_trained.best_iteration == 10
-    assert np.allclose(model_trained.best_score, 0.9971296557418077, atol=1e-5)
-    assert np.allclose(model_trained.best_score_train, 0.6433719740056012, atol=1e-5)
-    if torch_tensors:
-        assert np.allclose(
-            model_trained.predict(toy_valid_set),
-            np.array(
-                [
-                    [0.32716662, 0.53836168, 0.1344717],
-                    [0.16751941, 0.27565781, 0.55682278],
-                    [0.16751941, 0.27565781, 0.55682278],
-                ]
-            ),
-            rtol=1e-5,
+    best_score, best_score_train, preds = expected_results
+    # the validation loss is the lowest after the first iteration
+    assert model_trained.best_iteration == 1
+    # losses are reported in float64, even with float32 probabilities
+    assert isinstance(model_trained.best_score, np.float64)
+    assert isinstance(model_trained.best_score_train, np.float64)
+    assert np.allclose(model_trained.best_score, best_score, atol=1e-5)
+    assert np.allclose(model_trained.best_score_train, best_score_train, atol=1e-5)
+    assert np.allclose(model_trained.predict(toy_valid_set), preds, rtol=1e-5)
+    # mu of the first nest is optimised, the second one is fixed
+    if model_trained.mu is not None:
+        assert model_trained.mu[0] != _SPEC_MU[0]
+        assert model_trained.mu[1] == _SPEC_MU[1]
+
+
+def test_train_dtype(create_model_spec, toy_train_set, toy_valid_set):
+    # probabilities are computed in the training dtype, which barely changes the losses
+    model_specification, _ = create_model_spec
+    losses = []
+    for dtype in (np.float32, np.float64):
+        model_trained = rum_train(
+            toy_train_set,
+            model_specification,
+            valid_sets=[toy_valid_set],
+            dtype=dtype,
         )
+        assert model_trained._preds.dtype == dtype
+        losses.append((model_trained.best_score, model_trained.best_score_train))
+    assert np.allclose(losses[0], losses[1], rtol=1e-5)
+
+
+@pytest.mark.skipif(not NUMBA_INSTALLED, reason="numba is not installed")
+def test_numba_f_obj(toy_attributes, monkeypatch):
+    # the numba kernel should give the same gradient and hessian as numpy
+    rng = np.random.default_rng(0)
+    model = rumb.RUMBoost(model_file=None, **toy_attributes)
+    model.subsample_idx = np.arange(4)
+    model.boost_from_parameter_space = [False] * 4
+    model._preds = rng.dirichlet(np.ones(3), size=4)
+
+    for j in [0, 3]:  # alternative-specific and shared ensembles
+        model._current_j = j
+        monkeypatch.setattr("rumboost.rumboost.numba_installed", True)
+        grad_numba, hess_numba = model.f_obj(None, None)
+        monkeypatch.setattr("rumboost.rumboost.numba_installed", False)
+        grad, hess = model.f_obj(None, None)
+        assert np.allclose(grad_numba, grad)
+        assert np.allclose(hess_numba, hess)
+
+
+@pytest.mark.skipif(not NUMBA_INSTALLED, reason="numba is not installed")
+def test_numba_f_obj_nested_cross_nested(toy_attributes, monkeypatch):
+    # the numba kernels should give the same gradient and hessian as numpy
+    rng = np.random.default_rng(0)
+    raw_preds = rng.normal(size=(4, 3))
+    model = rumb.RUMBoost(model_file=None, **toy_attributes)
+    model._current_j = 3  # shared ensemble, utilities 0, 1 and 2
+    model.subsample_idx = np.arange(4)
+    model.boost_from_parameter_space = [False] * 4
+    model.mu = np.array([1.5, 1.25])
+
+    _, model.preds_i_m, model.preds_m = nest_probs(
+        raw_preds, model.mu, model.nests, model.nest_alt
+    )
+    grad_numba, hess_numba = model.f_obj_nest(None, None)
+    monkeypatch.setattr("rumboost.rumboost.numba_installed", False)
+    grad, hess = model.f_obj_nest(None, None)
+    assert np.allclose(grad_numba, grad)
+    assert np.allclose(hess_numba, hess)
+
+    monkeypatch.setattr("rumboost.rumboost.numba_installed", True)
+    model._preds, model.preds_i_m, model.preds_m = cross_nested_probs(
+        raw_preds, model.mu, model.alphas
+    )
+    grad_numba, hess_numba = model.f_obj_cross_nested(None, None)
+    monkeypatch.setattr("rumboost.rumboost.numba_installed", False)
+    grad, hess = model.f_obj_cross_nested(None, None)
+    assert np.allclose(grad_numba, grad)
+    assert np.allclose(hess_numba, hess)
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_nested_probs_large_utilities(dtype):
+    # the log-sum-exp shift must not empty the nests at large utility spreads
+    raw_preds = np.array([[-400, 400, -400], [300, -300, 0]], dtype=dtype)
+    expected = np.array([[0, 1, 0], [1, 0, 0]])
+
+    preds, pred_i_m, pred_m = nest_probs(
+        raw_preds, np.array([1.5, 1], dtype=dtype), {0: [0, 1], 1: [2]}, _NEST_ALT
+    )
+    assert np.isfinite(pred_i_m).all() and np.isfinite(pred_m).all()
+    assert np.allclose(preds, expected)
+
+    preds, pred_i_m, pred_m = cross_nested_probs(
+        raw_preds, _MU.astype(dtype), _ALPHAS.astype(dtype)
+    )
+    assert np.isfinite(pred_i_m).all() and np.isfinite(pred_m).all()
+    assert np.allclose(preds, expected)
+
+
+def test_shared_ensemble_stacking(toy_attributes):
+    # the features of a shared ensemble are stacked column by column, as its labels,
+    # also for DataFrames built from a C-contiguous array whose .values are C-ordered
+    columns = ["0", "1", "2", "3", "4", "5"]
+    features = np.arange(24, dtype=np.float64).reshape(4, 6)
+    df = pd.DataFrame(features, columns=columns)
+    assert df[["3", "4", "5"]].values.flags.c_contiguous
+    shared_data = features[:, 3:].reshape(-1, order="F")
+
+    model = rumb.RUMBoost(model_file=None, **toy_attributes)
+    model._preprocess_data(
+        Dataset(df, label=_LABELS, free_raw_data=False), free_raw_data=False
+    )
+    assert (model.train_set[3].data[:, 0] == shared_data).all()
+    assert (model.train_set[0].data == features[:, :2]).all()
+
+    df["choice"] = _LABELS
+    train_sets, _ = prepare_dataset(
+        toy_attributes["rum_structure"], df, 3, df_test=[df], free_raw_data=False
+    )
+    assert (train_sets["train_sets"][3].data[:, 0] == shared_data).all()
+    assert (train_sets["train_sets"][0].data == features[:, :2]).all()
+
+
+def test_shared_bin_mappers(toy_train_set, toy_attributes):
+    # boosters with the same features and parameters share the first binned dataset
+    rum_structure = copy.deepcopy(toy_attributes["rum_structure"][:3])
+    rum_structure[1]["variables"] = ["0", "1"]
+    attributes = dict(toy_attributes, rum_structure=rum_structure)
+    model = rumb.RUMBoost(model_file=None, **attributes)
+    model._preprocess_data(toy_train_set)
+    assert model.train_set[0].reference is None
+    assert model.train_set[1].reference is model.train_set[0]
+    assert model.train_set[2].reference is None
+
+    booster = Booster(
+        train_set=model.train_set[1], params=rum_structure[1]["boosting_params"]
+    )
+    assert booster.feature_name() == ["0", "1"]
+
+
+def test_shared_bin_mappers_utilities(toy_attributes):
+    # shared ensembles of the same features but of a different number of
+    # utilities do not share their bin mappers
+    rum_structure = copy.deepcopy(toy_attributes["rum_structure"][:4])
+    rum_structure.append(
+        dict(copy.deepcopy(rum_structure[3]), utility=[1, 2, 0], variables=["3", "4"])
+    )
+    rum_structure.append(
+        dict(copy.deepcopy(rum_structure[3]), utility=[2, 1], variables=["3", "4"])
+    )
+    rum_structure.append(
+        dict(copy.deepcopy(rum_structure[3]), utility=[0, 2], variables=["3", "4"])
+    )
+    df = pd.DataFrame(np.arange(24, dtype=np.float64).reshape(4, 6))
+    df.columns = ["0", "1", "2", "3", "4", "5"]
+    df["choice"] = _LABELS
+    train_sets, _ = prepare_dataset(rum_structure, df, 3, df_test=[df])
+    assert train_sets["train_sets"][4].reference is None
+    assert train_sets["train_sets"][5].reference is None
+    assert train_sets["train_sets"][6].reference is train_sets["train_sets"][5]
+
+
+@pytest.mark.parametrize("num_parallel_boosters", [1, 3])
+@pytest.mark.parametrize("verbosity", [-1, 1])
+def test_lightgbm_verbosity(
+    toy_train_set,
+    toy_valid_set,
+    toy_attributes,
+    verbosity,
+    num_parallel_boosters,
+    capsys,
+):
+    # the verbosity of the general parameters reaches the LightGBM datasets and
+    # boosters, also when they are updated in threads
+    model_specification = copy.deepcopy(
+        {
+            "general_params": toy_attributes["general_params"],
+            "rum_structure": toy_attributes["rum_structure"],
+        }
+    )
+    model_specification["general_params"]["verbosity"] = verbosity
+    model_specification["general_params"][
+        "num_parallel_boosters"
+    ] = num_parallel_boosters
+    rum_train(toy_train_set, model_specification, valid_sets=[toy_valid_set])
+    out = capsys.readouterr().out
+    if verbosity > 0:
+        assert "[LightGBM] [Info]" in out
     else:
-        assert np.allclose(
-            model_trained.predict(toy_valid_set),
-            np.array(
-                [
-                    [0.32716662, 0.53836168, 0.1344717],
-                    [0.16751941, 0.27565781, 0.55682278],
-                    [0.16751941, 0.27565781, 0.55682278],
-                ]
-            ),
-            rtol=1e-5,
+        assert "[LightGBM]" not in out
+
+
+def test_parallel_boosters(toy_train_set, toy_valid_set, toy_attributes):
+    # updating the boosters in threads should not change the trained model
+    preds = []
+    for num_parallel_boosters in [1, 2]:
+        model_specification = copy.deepcopy(
+            {
+                "general_params": toy_attributes["general_params"],
+                "rum_structure": toy_attributes["rum_structure"],
+            }
+        )
+        model_specification["general_params"][
+            "num_parallel_boosters"
+        ] = num_parallel_boosters
+        # the threads given by the user are shared between the boosters
+        model_specification["general_params"]["num_threads"] = 4
+        model_specification["rum_structure"][0]["boosting_params"] = dict(
+            model_specification["rum_structure"][0]["boosting_params"], n_jobs=1
+        )
+        model_trained = rum_train(
+            toy_train_set, model_specification, valid_sets=[toy_valid_set]
+        )
+        preds.append(model_trained.predict(toy_valid_set))
+        # the threads are shared in the boosters only, not in the user's
+        # specification, and not in the boosters with their own number of threads
+        assert "num_threads" not in model_trained.boosters[0].params
+        num_threads = 2 if num_parallel_boosters > 1 else None
+        assert all(
+            booster.params.get("num_threads") == num_threads
+            for booster in model_trained.boosters[1:]
+        )
+        assert not any(
+            "num_threads" in struct["boosting_params"]
+            for struct in model_specification["rum_structure"]
+        )
+    assert np.allclose(preds[0], preds[1])
+
+
+@pytest.mark.parametrize(
+    "model_spec",
+    [
+        {"nested_logit": _NESTED_LOGIT},
+        {"cross_nested_logit": _CROSS_NESTED_LOGIT},
+    ],
+)
+def test_optimise_mu_or_alpha_raw_preds(
+    toy_train_set, toy_valid_set, toy_attributes, model_spec, monkeypatch
+):
+    # mu and alphas optimised from the raw predictions gathered once per round
+    # are the same as when gathering them at each evaluation of the loss
+    def optimise_without_raw_preds(params_to_optimise, *args):
+        calls.append(args[-1])
+        return optimise_mu_or_alpha(params_to_optimise, *args[:-1])
+
+    models = []
+    for patch in [False, True]:
+        calls = []
+        if patch:
+            monkeypatch.setattr(
+                "rumboost.rumboost.optimise_mu_or_alpha", optimise_without_raw_preds
+            )
+        model_specification = copy.deepcopy(
+            {
+                "general_params": toy_attributes["general_params"],
+                "rum_structure": toy_attributes["rum_structure"],
+                **model_spec,
+            }
+        )
+        models.append(
+            rum_train(toy_train_set, model_specification, valid_sets=[toy_valid_set])
+        )
+    assert calls and all(raw_preds.shape == (4, 3) for raw_preds in calls)
+    assert models[0].mu[0] != _SPEC_MU[0]
+    assert np.allclose(models[0].mu, models[1].mu)
+    if models[0].alphas is not None:
+        assert np.allclose(models[0].alphas, models[1].alphas)
+        assert not np.allclose(models[0].alphas, _ALPHAS)
+
+
+def test_as_numpy():
+    # same arrays as converting the selected columns with pandas
+    df = pd.DataFrame(
+        {"0": [1.5, 2.5, 3.5], "1": [1, 2, 3], "2": [0.1, 0.2, 0.3]},
+    )
+    columns = ["2", "1"]
+    for num_rows in [3, 6]:
+        expected = np.ascontiguousarray(
+            df[columns].to_numpy().reshape((num_rows, -1), order="F")
         )
+        array = _as_numpy(df, columns, num_rows)
+        assert array.dtype == np.float64 and array.flags.c_contiguous
+        assert (array == expected).all()
+        assert (_as_numpy(df.to_numpy(), [2, 1], num_rows) == expected).all()
+    assert (_as_numpy(df) == df.to_numpy()).all()
+    # float64 features are not rounded, other types are cast to float32 as in lightgbm
+    df["0"] = [2**24 + 1, 0.1, 0.2]
+    assert _as_numpy(df, ["0"])[0, 0] == 2**24 + 1
+    assert _as_numpy(df, ["1"]).dtype == np.float32
+    assert _as_numpy(df.astype(np.float32)).dtype == np.float32
 
 
 #
@@ -693,3 +997,17 @@ def test_simple_train(
 #    assert isinstance(train_set_J[0], Dataset)
 #    assert isinstance(reduced_valid_sets_J[0][0], Dataset)
 #
+
+
+def test_preprocess_subset(toy_train_set, toy_attributes):
+    # subsets of a Dataset created with free_raw_data=True, as the folds of rum_cv,
+    # read their raw data from their reference as long as it has not been freed
+    used_indices = [0, 1, 3]
+    model = rumb.RUMBoost(model_file=None, **toy_attributes)
+    model._preprocess_data(toy_train_set.subset(used_indices))
+    assert (model.labels == np.array([0, 1, 1])).all()
+    assert (model.train_set[0].data[:, 1] == np.array([4, 5, 1])).all()
+
+    toy_train_set.construct()
+    with pytest.raises(ValueError, match="free_raw_data=False"):
+        model._preprocess_data(toy_train_set.subset(used_indices))